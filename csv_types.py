@@ -0,0 +1,95 @@
+# Column type classification and sampling for CSV data, kept free of GCP dependencies so it can be tested on its own
+
+import csv
+
+# Column type codes, ordered so that max() applies the promotion rule: STRING dominates, FLOAT > INTEGER.
+# Empty cells are neutral; a column with nothing but empty cells is loaded as STRING.
+TYPE_EMPTY, TYPE_INTEGER, TYPE_FLOAT, TYPE_STRING = 0, 1, 2, 3
+BQ_TYPE_NAMES = ('STRING', 'INTEGER', 'FLOAT', 'STRING')
+TYPE_RANK = {'INTEGER': TYPE_INTEGER, 'FLOAT': TYPE_FLOAT, 'STRING': TYPE_STRING}
+
+# INT64 holds every 18-digit number but not every 19-digit one, so longer digit strings (IDs, keys) stay STRING
+MAX_INTEGER_DIGITS = 18
+
+# The rules of infer_column_type as patterns, for classifying whole Arrow columns at once
+INTEGER_PATTERN = rf'^[+-]?(0|[1-9][0-9]{{0,{MAX_INTEGER_DIGITS - 1}}})$'
+FLOAT_PATTERN = r'^[+-]?((0|[1-9][0-9]*)\.[0-9]*|\.[0-9]+)$'
+
+def infer_column_type(value: str) -> int:
+    
+    # Classifies a single CSV value into a column type code with str methods only, without raising or parsing.
+    # Numbers are an optional sign followed by ASCII digits with at most one '.' ('1.' and '.5' count, '.' alone does not).
+    # Leading zeros ('007', '00123') mark codes whose zeros a number would drop, so those values are STRING.
+    
+    if not value:
+        return TYPE_EMPTY
+    digits = value[1:] if value[0] in '+-' else value
+    if not digits.isascii():
+        return TYPE_STRING
+    if digits.isdigit():
+        if len(digits) > MAX_INTEGER_DIGITS or (digits[0] == '0' and len(digits) > 1):
+            return TYPE_STRING
+        return TYPE_INTEGER
+    whole, dot, fraction = digits.partition('.')
+    if dot and (whole + fraction).isdigit() and not (whole[:1] == '0' and len(whole) > 1):
+        return TYPE_FLOAT
+    return TYPE_STRING
+
+def classify_csv_rows(rows, column_types: list[int]):
+    
+    # Promotes column_types in place with the values of the given rows.
+    
+    num_columns = len(column_types)
+    for row in rows:
+        for j, value in enumerate(row[:num_columns]):
+            inferred_type = infer_column_type(value)
+            if inferred_type > column_types[j]:
+                column_types[j] = inferred_type
+
+def parse_csv_header(data) -> tuple[list[str], int]:
+    
+    # Parses the header line at the start of CSV data (bytes or a mmap) and returns its names and the offset of the first data row.
+    
+    header_end = data.find(b'\n') + 1 or len(data)
+    return next(csv.reader([data[:header_end].decode('utf-8')], delimiter=';'), []), header_end
+
+def iter_chunk_bounds(data, start: int, chunk_size: int):
+    
+    # Yields (start, end) offsets that cut data[start:] into chunks of about chunk_size bytes.
+    # Each cut is moved back to the last newline so no row is split between chunks; a row longer than a chunk is cut where it is.
+    
+    size = len(data)
+    while start < size:
+        end = min(start + chunk_size, size)
+        if end < size:
+            newline = data.rfind(b'\n', start, end)
+            if newline != -1:
+                end = newline + 1
+        yield start, end
+        start = end
+
+def sample_csv_rows(data, start: int, end: int, num_rows: int) -> list[list[str]]:
+    
+    # Parses the first num_rows rows of data[start:end], which must start at a row boundary.
+    
+    sample_end = start
+    for _ in range(num_rows):
+        newline = data.find(b'\n', sample_end, end)
+        if newline == -1:
+            sample_end = end
+            break
+        sample_end = newline + 1
+    return list(csv.reader(data[start:sample_end].decode('utf-8').splitlines(), delimiter=';'))
+
+def sample_column_types(data, chunk_size: int, num_rows: int, complete: bool = True) -> tuple[list[str], list[int]]:
+    
+    # Classifies the first num_rows rows of every chunk of CSV data (bytes or a mmap, header included) and returns the header and column types.
+    # Pass complete=False when data is only the first block of a file, so its trailing partial row is left out.
+    
+    if not complete:
+        data = data[:data.rfind(b'\n') + 1]
+    headers, data_start = parse_csv_header(data)
+    column_types = [TYPE_EMPTY] * len(headers)
+    for start, end in iter_chunk_bounds(data, data_start, chunk_size):
+        classify_csv_rows(sample_csv_rows(data, start, end, num_rows), column_types)
+    return headers, column_types
@@ -0,0 +1,116 @@
+import re
+import unittest
+
+from csv_types import (
+    FLOAT_PATTERN, INTEGER_PATTERN, TYPE_EMPTY, TYPE_FLOAT, TYPE_INTEGER, TYPE_STRING,
+    infer_column_type, iter_chunk_bounds, parse_csv_header, sample_column_types, sample_csv_rows,
+)
+
+
+class InferColumnTypeTest(unittest.TestCase):
+
+    def assertTypes(self, expected_type, values):
+        for value in values:
+            with self.subTest(value=value):
+                self.assertEqual(infer_column_type(value), expected_type)
+
+    def test_empty_is_neutral(self):
+        self.assertEqual(infer_column_type(''), TYPE_EMPTY)
+        self.assertLess(TYPE_EMPTY, min(TYPE_INTEGER, TYPE_FLOAT, TYPE_STRING))
+
+    INTEGERS = ['0', '-0', '42', '-7', '+7', '123456789012345678', '-123456789012345678']
+    FLOATS = ['1.5', '-0.25', '+3.0', '0.5', '1.', '0.', '.5', '-.5', '12345678901234567890.5']
+    STRINGS = [
+        '.', '-', '+', '+-1', '--1', '1-', '1.2.3', '1,5', '1e5', ' 1', 'abc',
+        'NA', 'NULL', 'nan', 'inf', '١٢٣', 'São Paulo',
+    ]
+    # Codes with leading zeros and digit strings too long for INT64
+    CODES = ['007', '00123', '-007', '00.5', '1234567890123456789', '12345678901234567890']
+
+    def test_integers(self):
+        self.assertTypes(TYPE_INTEGER, self.INTEGERS)
+
+    def test_floats(self):
+        self.assertTypes(TYPE_FLOAT, self.FLOATS)
+
+    def test_strings(self):
+        self.assertTypes(TYPE_STRING, self.STRINGS)
+
+    def test_codes_and_long_digit_strings_are_strings(self):
+        self.assertTypes(TYPE_STRING, self.CODES)
+
+    def test_patterns_agree_with_classifier(self):
+        for value in self.INTEGERS + self.FLOATS + self.STRINGS + self.CODES:
+            with self.subTest(value=value):
+                if re.fullmatch(INTEGER_PATTERN, value):
+                    pattern_type = TYPE_INTEGER
+                elif re.fullmatch(FLOAT_PATTERN, value):
+                    pattern_type = TYPE_FLOAT
+                else:
+                    pattern_type = TYPE_STRING
+                self.assertEqual(pattern_type, infer_column_type(value))
+
+
+
+class ChunkSamplingTest(unittest.TestCase):
+
+    DATA = b'id;name\n1;a\n22;b\n333;c\n'
+
+    def test_parse_header(self):
+        self.assertEqual(parse_csv_header(self.DATA), (['id', 'name'], 8))
+
+    def test_header_only_file(self):
+        for data in (b'id;name\n', b'id;name'):
+            with self.subTest(data=data):
+                headers, data_start = parse_csv_header(data)
+                self.assertEqual(headers, ['id', 'name'])
+                self.assertEqual(list(iter_chunk_bounds(data, data_start, 4)), [])
+                self.assertEqual(sample_column_types(data, 4, 10), (['id', 'name'], [TYPE_EMPTY, TYPE_EMPTY]))
+
+    def test_cuts_move_back_to_last_newline(self):
+        # Rows start at 8, 12 and 17; cuts every 6 bytes would split '22;b' and '333;c'
+        bounds = list(iter_chunk_bounds(self.DATA, 8, 6))
+        self.assertEqual(bounds, [(8, 12), (12, 17), (17, 23)])
+        for start, end in bounds:
+            self.assertEqual(self.DATA[end - 1:end], b'\n')
+
+    def test_last_chunk_without_trailing_newline(self):
+        data = self.DATA + b'4444;d'
+        bounds = list(iter_chunk_bounds(data, 8, 12))
+        self.assertEqual(bounds[-1][1], len(data))
+        self.assertEqual(sample_csv_rows(data, *bounds[-1], 10)[-1], ['4444', 'd'])
+
+    def test_row_longer_than_chunk_is_cut(self):
+        self.assertEqual(list(iter_chunk_bounds(b'h\n123456789\n', 2, 4)), [(2, 6), (6, 10), (10, 12)])
+
+    def test_sample_stops_after_num_rows(self):
+        self.assertEqual(sample_csv_rows(self.DATA, 8, len(self.DATA), 2), [['1', 'a'], ['22', 'b']])
+
+    def test_later_chunks_promote_types(self):
+        data = b'id;value\n1;1\n2;2\n3;x\n4;4.5\n'
+        # One row sampled per chunk of one row each still reaches the STRING in the third row
+        self.assertEqual(sample_column_types(data, 4, 1), (['id', 'value'], [TYPE_INTEGER, TYPE_STRING]))
+        # Sampling only the first chunk misses it
+        self.assertEqual(sample_column_types(data, len(data), 2), (['id', 'value'], [TYPE_INTEGER, TYPE_INTEGER]))
+
+
+class FirstBlockSamplingTest(unittest.TestCase):
+
+    def test_partial_last_row_is_left_out(self):
+        # The block ends inside '2.5', which would otherwise be sampled as the INTEGER '2'
+        block = b'id;value\n1;1\n2;2'
+        self.assertEqual(sample_column_types(block, len(block), 10, complete=False), (['id', 'value'], [TYPE_INTEGER, TYPE_INTEGER]))
+        self.assertEqual(sample_column_types(block + b'.5\n', len(block) + 3, 10), (['id', 'value'], [TYPE_INTEGER, TYPE_FLOAT]))
+
+    def test_whole_file_block_keeps_last_row(self):
+        block = b'id;value\n1;1\n2;x'
+        self.assertEqual(sample_column_types(block, len(block), 10), (['id', 'value'], [TYPE_INTEGER, TYPE_STRING]))
+
+    def test_block_with_partial_header_has_no_columns(self):
+        self.assertEqual(sample_column_types(b'id;val', 6, 10, complete=False), ([], []))
+
+    def test_header_only_block(self):
+        self.assertEqual(sample_column_types(b'id;value\n1;', 11, 10, complete=False), (['id', 'value'], [TYPE_EMPTY, TYPE_EMPTY]))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,8 +1,34 @@
 import os
+import re
 import csv
+import gzip
+import json
+import mmap
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from itertools import islice, repeat
 from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
 from google.cloud import storage, bigquery
+from google.cloud.storage import transfer_manager
 from google.cloud.exceptions import NotFound
+from csv_types import TYPE_EMPTY, TYPE_INTEGER, TYPE_FLOAT, TYPE_STRING, BQ_TYPE_NAMES, TYPE_RANK, INTEGER_PATTERN, FLOAT_PATTERN, classify_csv_rows, sample_column_types
+
+# PyArrow is optional; without it every file is loaded as CSV
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.csv as pacsv
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+# The BigQuery Storage Write API is optional; without it small files go through GCS like the rest
+try:
+    from google.cloud.bigquery_storage_v1 import BigQueryWriteClient, types as bqstorage_types
+except ImportError:
+    BigQueryWriteClient = None
 
 # Load env variables
 load_dotenv()
@@ -12,6 +38,46 @@ GCP_PROJECT_ID = os.getenv("GCP_PROJECT_ID")
 GCP_BUCKET_NAME = os.getenv("GCP_BUCKET_NAME")
 GCP_SERVICE_ACCOUNT_KEY_PATH = os.getenv("GCP_SERVICE_ACCOUNT_KEY_PATH")
 BIGQUERY_DATASET_ID = os.getenv("BIGQUERY_DATASET_ID")
+UPLOAD_CONCURRENCY = int(os.getenv("UPLOAD_CONCURRENCY", 16))
+
+# Files above this size are sliced and uploaded as parallel parts
+PARALLEL_UPLOAD_THRESHOLD = 100 * 1024 * 1024
+PARALLEL_UPLOAD_CHUNK_SIZE = 32 * 1024 * 1024
+PARALLEL_UPLOAD_WORKERS = 8
+
+# Connection pool per Storage client and chunk size for resumable uploads
+STORAGE_HTTP_POOL_SIZE = 64
+RESUMABLE_UPLOAD_CHUNK_SIZE = 32 * 1024 * 1024
+
+# Files at least this large are converted to Parquet before upload (requires pyarrow)
+PARQUET_MIN_BYTES = int(os.getenv("PARQUET_MIN_BYTES", 100 * 1024 * 1024))
+ARROW_CSV_BLOCK_SIZE = 32 << 20
+ARROW_INFERENCE_BLOCK_SIZE = 1 << 20
+INFERENCE_READ_BUFFER_SIZE = 1 << 20
+NUM_ROWS_FOR_INFERENCE = 100
+
+# Files at least this large are sampled across the whole file, chunk by chunk
+CHUNK_SAMPLED_INFERENCE_MIN_BYTES = int(os.getenv("CHUNK_SAMPLED_INFERENCE_MIN_BYTES", 1 << 30))
+INFERENCE_CHUNK_SIZE = 32 * 1024 * 1024
+
+# Files below this size are written straight to BigQuery with the Storage Write API (requires pyarrow)
+STORAGE_WRITE_MAX_BYTES = int(os.getenv("STORAGE_WRITE_MAX_BYTES", 50 * 1024 * 1024))
+# Files below this size are sent to BigQuery in the load request itself, skipping the GCS hop. Off (0) by default:
+# each direct load is a job of its own, while files staged in GCS are loaded with one job per table.
+DIRECT_LOAD_MAX_BYTES = int(os.getenv("DIRECT_LOAD_MAX_BYTES", 0))
+# AppendRows requests are capped at 10 MB, so batches aim below that
+APPEND_ROWS_BATCH_BYTES = 8 * 1024 * 1024
+
+GZIP_COMPRESS_LEVEL = 6
+COPY_BUFFER_SIZE = 1024 * 1024
+
+# Inferred schemas are persisted here so re-runs can skip inference
+SCHEMA_CACHE_DIR = os.getenv("SCHEMA_CACHE_DIR", ".schema_cache")
+
+# Parent directory for the staged .csv.gz/.parquet copies (defaults to the system temp dir, often a size-limited tmpfs).
+# Staged files are only removed after every file has been uploaded, so it needs roughly the combined size of all
+# compressed/Parquet copies free, i.e. of every CSV that goes through GCS (by default, all but those written with the Storage Write API).
+STAGING_DIR = os.getenv("STAGING_DIR") or None
 
 # Basic check to ensure credentials are loaded
 if not all([GCP_PROJECT_ID, GCP_BUCKET_NAME, GCP_SERVICE_ACCOUNT_KEY_PATH, BIGQUERY_DATASET_ID]):
@@ -21,129 +87,466 @@ if not all([GCP_PROJECT_ID, GCP_BUCKET_NAME, GCP_SERVICE_ACCOUNT_KEY_PATH, BIGQU
 try:
     storage_client = storage.Client.from_service_account_json(GCP_SERVICE_ACCOUNT_KEY_PATH, project=GCP_PROJECT_ID)
     bigquery_client = bigquery.Client.from_service_account_json(GCP_SERVICE_ACCOUNT_KEY_PATH, project=GCP_PROJECT_ID)
+    bigquery_write_client = BigQueryWriteClient.from_service_account_json(GCP_SERVICE_ACCOUNT_KEY_PATH) if BigQueryWriteClient else None
     print(f"Successfully connected to GCP Project: {GCP_PROJECT_ID}")
 except Exception as e:
     raise RuntimeError(f"Failed to initialize GCP clients. Check your service account key path and permissions: {e}")
 
-# Helper function for data type inference
-def infer_column_type(value):
+# Uploads all run from the main thread after staging, so one Storage client is enough;
+# keep its connections alive across uploads instead of re-doing TLS handshakes
+storage_client._http.mount('https://', HTTPAdapter(pool_connections=STORAGE_HTTP_POOL_SIZE, pool_maxsize=STORAGE_HTTP_POOL_SIZE))
+
+
+# Characters not allowed in BigQuery column names (same set the original isalnum()/underscore check rejected)
+COLUMN_NAME_INVALID_CHARS = re.compile(r'\W')
+
+# Only empty cells count as null for the Arrow reader, like the empty cells skipped by infer_column_type.
+# Arrow's defaults would also null out values such as 'NA', 'NULL' or 'nan', which the csv module route types as STRING.
+ARROW_NULL_VALUES = ['']
+
+def sanitize_column_names(headers: list[str]) -> list[str]:
     
-    # Infers the BigQuery data type from a given value.
+    # Turns CSV header names into valid BigQuery column names.
+    
+    return [COLUMN_NAME_INVALID_CHARS.sub('_', header).lower() for header in headers]
+
+def read_csv_header(file_path: str) -> list[str]:
+    
+    # Reads only the header line of a CSV file and returns its sanitized column names.
+    
+    with open(file_path, 'r', encoding='utf-8', newline='') as csvfile:
+        return sanitize_column_names(next(csv.reader(csvfile, delimiter=';'), []))
+
+def get_table_schema_with_arrow(file_path: str) -> list[bigquery.SchemaField]:
+    
+    # Infers table schema with PyArrow's CSV reader: the first block of the file is read as strings and each column is
+    # classified at once with the patterns of infer_column_type, so both routes type the same values the same way.
+    
+    with open(file_path, 'r', encoding='utf-8', newline='') as csvfile:
+        headers = next(csv.reader(csvfile, delimiter=';'), [])
+    # Positional names, so duplicated headers don't collide in column_types
+    column_names = [str(i) for i in range(len(headers))]
+
+    with pacsv.open_csv(
+        file_path,
+        read_options=pacsv.ReadOptions(block_size=ARROW_INFERENCE_BLOCK_SIZE, column_names=column_names, skip_rows=1),
+        parse_options=pacsv.ParseOptions(delimiter=';'),
+        convert_options=pacsv.ConvertOptions(
+            column_types={name: pa.string() for name in column_names},
+            null_values=ARROW_NULL_VALUES,
+            strings_can_be_null=True
+        )
+    ) as reader:
+        first_batch = next(iter(reader), None)
+
+    column_types = [TYPE_EMPTY] * len(headers)
+    if first_batch is not None:
+        for j, column in enumerate(first_batch.columns):
+            if column.null_count == len(column):
+                continue
+            is_integer = pc.match_substring_regex(column, INTEGER_PATTERN)
+            if pc.all(is_integer).as_py():
+                column_types[j] = TYPE_INTEGER
+            elif pc.all(pc.or_(is_integer, pc.match_substring_regex(column, FLOAT_PATTERN))).as_py():
+                column_types[j] = TYPE_FLOAT
+            else:
+                column_types[j] = TYPE_STRING
+    return build_schema_fields(headers, column_types)
+
+def build_schema_fields(headers: list[str], column_types: list[int]) -> list[bigquery.SchemaField]:
+    
+    # Turns classified column types into BigQuery schema fields.
+    
+    return [
+        bigquery.SchemaField(name, BQ_TYPE_NAMES[column_type], mode='NULLABLE')
+        for name, column_type in zip(sanitize_column_names(headers), column_types)
+    ]
+
+def get_table_schema_with_csv_module(file_path: str, num_rows_for_inference: int) -> list[bigquery.SchemaField]:
+    
+    # Infers table schema by classifying the first rows of the file value by value.
+    
+    # A large read buffer and newline='' (left to the csv module) keep the sampling to a few big reads
+    with open(file_path, 'r', encoding='utf-8', newline='', buffering=INFERENCE_READ_BUFFER_SIZE) as csvfile:
+        reader = csv.reader(csvfile, delimiter=';')
+        headers = next(reader)
+        column_types = [TYPE_EMPTY] * len(headers)
+        classify_csv_rows(islice(reader, num_rows_for_inference), column_types)
+
+    return build_schema_fields(headers, column_types)
+
+def get_table_schema_from_chunk_samples(file_path: str, num_rows_for_inference: int) -> list[bigquery.SchemaField]:
+    
+    # Infers table schema from samples spread over the whole file: the first rows of every newline-aligned chunk are classified, so STRING dominates across chunks.
+    # Each sample is small, so a plain loop over one mapping is enough; files are already processed concurrently by the caller's thread pool.
+    
+    with open(file_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        headers, column_types = sample_column_types(mm, INFERENCE_CHUNK_SIZE, num_rows_for_inference)
+
+    return build_schema_fields(headers, column_types)
+
+def get_table_schema_from_block(block: bytes, complete: bool, num_rows_for_inference: int = NUM_ROWS_FOR_INFERENCE) -> list[bigquery.SchemaField] | None:
+    
+    # Infers table schema from the first rows of a block read from the start of a CSV file; complete tells whether the block is the whole file.
     
-    if value is None or value == '':
-        return 'STRING'
-    if isinstance(value, bool):
-        return 'BOOLEAN'
-    try:
-        if float(value) == int(float(value)):
-            return 'INTEGER'
-    except ValueError:
-        pass
     try:
-        float(value)
-        return 'FLOAT'
-    except ValueError:
-        pass
-    return 'STRING'
+        headers, column_types = sample_column_types(block, len(block), num_rows_for_inference, complete)
+    except Exception as e:
+        print(f"Error inferring schema from the first block: {e}")
+        return None
+    if not headers:
+        return None
+    return build_schema_fields(headers, column_types)
 
-def get_table_schema_from_csv(file_path: str, num_rows_for_inference: int = 100) -> list[bigquery.SchemaField] | None:
+def get_table_schema_from_csv(file_path: str, num_rows_for_inference: int = NUM_ROWS_FOR_INFERENCE) -> list[bigquery.SchemaField] | None:
     
     # Infers table schema (column names and BigQuery types) from a CSV file.
+    # Very large files are sampled in chunks throughout, since their first rows are a poor sample.
+    # Otherwise PyArrow's vectorized parser is used when installed; the csv module covers files without it or dialects Arrow can't parse.
     
-    columns_info = {}
     try:
-        with open(file_path, 'r', encoding='utf-8') as csvfile:
-            reader = csv.reader(csvfile, delimiter=';')
-            headers = next(reader)
-
-            for header in headers:
-                sanitized_header = ''.join(c if c.isalnum() or c == '_' else '_' for c in header).lower()
-                columns_info[sanitized_header] = {'name': sanitized_header, 'type': 'STRING'}
-
-            rows_for_inference = []
-            for i, row in enumerate(reader):
-                if i < num_rows_for_inference:
-                    rows_for_inference.append(row)
-                else:
-                    break
-
-            for row_idx, row in enumerate(rows_for_inference):
-                for j, value in enumerate(row):
-                    if j < len(headers):
-                        header_name = ''.join(c if c.isalnum() or c == '_' else '_' for c in headers[j]).lower()
-                        current_type = columns_info[header_name]['type']
-                        inferred_type = infer_column_type(value)
-
-                        if inferred_type == 'STRING' and current_type != 'STRING':
-                            columns_info[header_name]['type'] = 'STRING'
-                        elif inferred_type == 'FLOAT' and current_type == 'INTEGER':
-                            columns_info[header_name]['type'] = 'FLOAT'
-
-        bq_schema_fields = []
-        for col_name, info in columns_info.items():
-            bq_schema_fields.append(bigquery.SchemaField(info['name'], info['type'], mode='NULLABLE'))
-
-        return bq_schema_fields
+        if os.path.getsize(file_path) >= CHUNK_SAMPLED_INFERENCE_MIN_BYTES:
+            return get_table_schema_from_chunk_samples(file_path, num_rows_for_inference)
+        if pa is not None:
+            try:
+                return get_table_schema_with_arrow(file_path)
+            except pa.ArrowInvalid as e:
+                print(f"PyArrow could not parse '{file_path}', inferring its schema with the csv module instead: {e}")
+        return get_table_schema_with_csv_module(file_path, num_rows_for_inference)
     except Exception as e:
         print(f"Error inferring schema from '{file_path}': {e}")
         return None
 
-def ensure_bigquery_dataset_exists(dataset_id: str):
+# Schema cache per table_id: {'schema': [SchemaField, ...], 'files': {filename: fingerprint}}
+SCHEMA_CACHE: dict[str, dict] = {}
+_schema_cache_locks: dict[str, threading.Lock] = {}
+
+def file_fingerprint(file_path: str, file_stat: os.stat_result | None = None) -> str:
+    
+    # Identifies a file's current contents by its size and modification time.
+    
+    stat = file_stat or os.stat(file_path)
+    return f"{stat.st_size}-{stat.st_mtime_ns}"
+
+def load_schema_cache_file(table_id: str) -> dict | None:
+    
+    # Reads a table's persisted schema cache entry, if there is one.
+    
+    cache_path = os.path.join(SCHEMA_CACHE_DIR, f"{table_id}.json")
+    try:
+        with open(cache_path, 'r', encoding='utf-8') as cache_file:
+            cached = json.load(cache_file)
+        return {
+            'schema': [bigquery.SchemaField.from_api_repr(field) for field in cached['schema']],
+            'files': cached['files']
+        }
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        print(f"Ignoring unreadable schema cache '{cache_path}': {e}")
+        return None
+
+def save_schema_cache_file(table_id: str, entry: dict):
+    
+    # Persists a table's schema cache entry next to the others in SCHEMA_CACHE_DIR.
+    
+    cache_path = os.path.join(SCHEMA_CACHE_DIR, f"{table_id}.json")
+    try:
+        os.makedirs(SCHEMA_CACHE_DIR, exist_ok=True)
+        with open(cache_path, 'w', encoding='utf-8') as cache_file:
+            json.dump({
+                'schema': [field.to_api_repr() for field in entry['schema']],
+                'files': entry['files']
+            }, cache_file, indent=2)
+    except OSError as e:
+        print(f"Could not write schema cache '{cache_path}': {e}")
+
+def get_table_schema(table_id: str, file_path: str, file_stat: os.stat_result | None = None, infer_schema=get_table_schema_from_csv) -> list[bigquery.SchemaField] | None:
     
-    # Ensures that the BigQuery dataset exists, creating it if necessary.
+    # Returns the schema for a table, reusing the cached one unless this file changed since it was last seen.
+    # A file new to the cache only reuses it when its header has the same columns in the same order.
+    # infer_schema(file_path) is only called on a cache miss.
     
+    filename = os.path.basename(file_path)
+    fingerprint = file_fingerprint(file_path, file_stat)
+
+    with _schema_cache_locks.setdefault(table_id, threading.Lock()):
+        entry = SCHEMA_CACHE.get(table_id) or load_schema_cache_file(table_id)
+        if entry and entry['files'].get(filename, fingerprint) == fingerprint and (
+            filename in entry['files'] or read_csv_header(file_path) == [field.name for field in entry['schema']]
+        ):
+            SCHEMA_CACHE[table_id] = entry
+            if filename not in entry['files']:
+                entry['files'][filename] = fingerprint
+                save_schema_cache_file(table_id, entry)
+            print(f"Using cached schema for table '{table_id}'.")
+            return entry['schema']
+
+        bq_schema = infer_schema(file_path)
+        if not bq_schema:
+            return None
+
+        entry = {'schema': bq_schema, 'files': {filename: fingerprint}}
+        SCHEMA_CACHE[table_id] = entry
+        save_schema_cache_file(table_id, entry)
+        return bq_schema
+
+# Datasets and tables (with their schemas) already checked during this run, so each is looked up only once
+_ensured_datasets: set[str] = set()
+_ensured_tables: dict[str, list[bigquery.SchemaField]] = {}
+
+def ensure_bigquery_dataset_exists(dataset_id: str, refresh: bool = False):
+    
+    # Ensures that the BigQuery dataset exists, creating it if necessary. Pass refresh=True to check again after an earlier success.
+    
+    if dataset_id in _ensured_datasets and not refresh:
+        return
+
     dataset_ref = bigquery_client.dataset(dataset_id)
     try:
         bigquery_client.get_dataset(dataset_ref)
         print(f"BigQuery Dataset '{dataset_id}' already exists.")
     except NotFound:
         print(f"BigQuery Dataset '{dataset_id}' not found. Creating it...")
-        bigquery_client.create_dataset(dataset_ref)
+        bigquery_client.create_dataset(dataset_ref, exists_ok=True)
         print(f"BigQuery Dataset '{dataset_id}' created.")
+    _ensured_datasets.add(dataset_id)
 
-def ensure_bigquery_table_exists(table_id: str, bq_schema: list[bigquery.SchemaField]):
+def ensure_bigquery_table_exists(table_id: str, bq_schema: list[bigquery.SchemaField], refresh: bool = False) -> list[bigquery.SchemaField] | None:
     
-    # Ensures that the BigQuery table exists with the specified schema and creates it if it doesn't exist.
+    # Ensures that the BigQuery table exists, creating it with the specified schema if it doesn't exist. Pass refresh=True to check again after an earlier success.
+    # Returns the schema data must be loaded with: the table's own, so an existing table only gets values its column types accept.
+    # CSV columns are matched by position, so None is returned (as on failure) when the table's column names differ from bq_schema's or are in another order.
     
-    dataset_ref = bigquery_client.dataset(BIGQUERY_DATASET_ID)
-    table_ref = dataset_ref.table(table_id)
+    if table_id not in _ensured_tables or refresh:
+        dataset_ref = bigquery_client.dataset(BIGQUERY_DATASET_ID)
+        table_ref = dataset_ref.table(table_id)
+
+        try:
+            table = bigquery_client.get_table(table_ref)
+            print(f"BigQuery Table '{BIGQUERY_DATASET_ID}.{table_id}' already exists.")
+            _ensured_tables[table_id] = table.schema
+        except NotFound:
+            print(f"BigQuery Table '{BIGQUERY_DATASET_ID}.{table_id}' not found. Creating it...")
+            table = bigquery.Table(table_ref, schema=bq_schema)
+            bigquery_client.create_table(table, exists_ok=True)
+            print(f"BigQuery Table '{BIGQUERY_DATASET_ID}.{table_id}' created successfully.")
+            _ensured_tables[table_id] = bq_schema
+        except Exception as e:
+            print(f"Error checking/creating BigQuery table '{BIGQUERY_DATASET_ID}.{table_id}': {e}")
+            return None
+
+    table_schema = _ensured_tables[table_id]
+    if [field.name for field in table_schema] != [field.name for field in bq_schema]:
+        print(f"Columns of BigQuery Table '{BIGQUERY_DATASET_ID}.{table_id}' ({', '.join(field.name for field in table_schema)}) do not match the file's ({', '.join(field.name for field in bq_schema)}).")
+        return None
+    if [field.field_type for field in table_schema] != [field.field_type for field in bq_schema]:
+        print(f"Inferred column types differ from BigQuery Table '{BIGQUERY_DATASET_ID}.{table_id}'. Loading with the table's schema.")
+    return table_schema
+
+def arrow_csv_options(bq_schema: list[bigquery.SchemaField]) -> dict:
+    
+    # Builds the PyArrow CSV reader options that make column names and types follow the BigQuery schema.
+    
+    arrow_types = {'INTEGER': pa.int64(), 'FLOAT': pa.float64(), 'STRING': pa.string()}
+    column_names = [field.name for field in bq_schema]
+    return {
+        'read_options': pacsv.ReadOptions(use_threads=True, block_size=ARROW_CSV_BLOCK_SIZE, column_names=column_names, skip_rows=1),
+        'parse_options': pacsv.ParseOptions(delimiter=';'),
+        'convert_options': pacsv.ConvertOptions(
+            column_types={field.name: arrow_types.get(field.field_type, pa.string()) for field in bq_schema},
+            null_values=ARROW_NULL_VALUES,
+            strings_can_be_null=True
+        )
+    }
+
+def read_csv_as_arrow_table(file_path: str, bq_schema: list[bigquery.SchemaField]):
+    
+    # Reads a whole CSV file into an Arrow table. Only used for files small enough for the Storage Write API.
+    
+    return pacsv.read_csv(file_path, **arrow_csv_options(bq_schema))
 
+def convert_csv_to_parquet(file_path: str, bq_schema: list[bigquery.SchemaField], parquet_path: str) -> bool:
+    
+    # Converts a CSV file into a snappy-compressed Parquet file at parquet_path.
+    # The CSV is streamed one record batch at a time, so memory use stays around ARROW_CSV_BLOCK_SIZE whatever the file size.
+    
     try:
-        bigquery_client.get_table(table_ref)
-        print(f"BigQuery Table '{BIGQUERY_DATASET_ID}.{table_id}' already exists.")
+        with pacsv.open_csv(file_path, **arrow_csv_options(bq_schema)) as reader:
+            with pq.ParquetWriter(parquet_path, reader.schema, compression='snappy') as writer:
+                for batch in reader:
+                    writer.write_batch(batch)
         return True
-    except NotFound:
-        print(f"BigQuery Table '{BIGQUERY_DATASET_ID}.{table_id}' not found. Creating it...")
-        table = bigquery.Table(table_ref, schema=bq_schema)
-        bigquery_client.create_table(table)
-        print(f"BigQuery Table '{BIGQUERY_DATASET_ID}.{table_id}' created successfully.")
+    except Exception as e:
+        print(f"Could not convert '{file_path}' to Parquet, uploading it as CSV instead: {e}")
+        if os.path.exists(parquet_path):
+            os.remove(parquet_path)
+        return False
+
+def write_csv_with_storage_api(file_path: str, table_id: str, bq_schema: list[bigquery.SchemaField]) -> bool:
+    
+    # Appends a CSV file to a BigQuery table through a pending Storage Write API stream, committed atomically once all rows are in.
+    
+    filename = os.path.basename(file_path)
+    try:
+        table = read_csv_as_arrow_table(file_path, bq_schema)
+        if table.num_rows == 0:
+            print(f"'{filename}' has no data rows. Nothing to write.")
+            return True
+
+        parent = BigQueryWriteClient.table_path(GCP_PROJECT_ID, BIGQUERY_DATASET_ID, table_id)
+        write_stream = bigquery_write_client.create_write_stream(
+            parent=parent,
+            write_stream=bqstorage_types.WriteStream(type_=bqstorage_types.WriteStream.Type.PENDING)
+        )
+
+        rows_per_batch = max(1, APPEND_ROWS_BATCH_BYTES * table.num_rows // max(table.nbytes, 1))
+        serialized_schema = table.schema.serialize().to_pybytes()
+
+        def append_requests():
+            offset = 0
+            for batch in table.to_batches(max_chunksize=rows_per_batch):
+                arrow_rows = bqstorage_types.AppendRowsRequest.ArrowData(
+                    rows=bqstorage_types.ArrowRecordBatch(serialized_record_batch=batch.serialize().to_pybytes())
+                )
+                # The writer schema only needs to be sent with the first request of the connection
+                if offset == 0:
+                    arrow_rows.writer_schema = bqstorage_types.ArrowSchema(serialized_schema=serialized_schema)
+                yield bqstorage_types.AppendRowsRequest(write_stream=write_stream.name, offset=offset, arrow_rows=arrow_rows)
+                offset += batch.num_rows
+
+        print(f"Writing '{filename}' into BigQuery table '{BIGQUERY_DATASET_ID}.{table_id}' with the Storage Write API...")
+        # The raw AppendRows call has no request to take routing from, so the stream is named in the header the backend requires
+        routing_metadata = (('x-goog-request-params', f"write_stream={write_stream.name}"),)
+        for response in bigquery_write_client.append_rows(requests=append_requests(), metadata=routing_metadata):
+            if response.error.code:
+                raise RuntimeError(response.error.message)
+
+        bigquery_write_client.finalize_write_stream(name=write_stream.name)
+        commit_response = bigquery_write_client.batch_commit_write_streams(
+            bqstorage_types.BatchCommitWriteStreamsRequest(parent=parent, write_streams=[write_stream.name])
+        )
+        if commit_response.stream_errors:
+            raise RuntimeError("; ".join(error.error_message for error in commit_response.stream_errors))
+
+        print(f"Successfully wrote {table.num_rows} rows from '{filename}' into BigQuery table '{BIGQUERY_DATASET_ID}.{table_id}'.")
         return True
     except Exception as e:
-        print(f"Error checking/creating BigQuery table '{BIGQUERY_DATASET_ID}.{table_id}': {e}")
+        print(f"Storage Write API failed for '{filename}', falling back to a load job: {e}")
         return False
 
+def compress_csv_to_gzip(file_path: str, gzip_path: str, first_block: bytes = b''):
+    
+    # Streams a CSV file through gzip into gzip_path. BigQuery loads .csv.gz files natively.
+    # first_block is the start of the file when it was already read (for schema inference); it is written as is instead of being read again.
+    
+    try:
+        with open(gzip_path, 'wb') as target, open(file_path, 'rb') as source:
+            source.seek(len(first_block))
+            with gzip.GzipFile(fileobj=target, mode='wb', compresslevel=GZIP_COMPRESS_LEVEL) as gzip_target:
+                gzip_target.write(first_block)
+                while block := source.read(COPY_BUFFER_SIZE):
+                    gzip_target.write(block)
+    except Exception:
+        if os.path.exists(gzip_path):
+            os.remove(gzip_path)
+        raise
+
 def upload_csv_to_gcs(file_path: str, filename: str, gcs_bucket_name: str, gcs_prefix: str = "raw_csv_uploads/"):
     
-    # Uploads a CSV file to Google Cloud Storage.
+    # Uploads a single staged file to Google Cloud Storage, in parallel parts when it is large.
     
     bucket = storage_client.bucket(gcs_bucket_name)
     blob_name = f"{gcs_prefix}{filename}"
-    blob = bucket.blob(blob_name)
+    blob = bucket.blob(blob_name, chunk_size=RESUMABLE_UPLOAD_CHUNK_SIZE)
 
     print(f"Uploading '{filename}' to GCS bucket '{gcs_bucket_name}' as '{blob_name}'...")
-    blob.upload_from_filename(file_path)
+    if os.path.getsize(file_path) > PARALLEL_UPLOAD_THRESHOLD:
+        # Parts are sent from threads, which share storage_client's connection pool
+        transfer_manager.upload_chunks_concurrently(
+            file_path,
+            blob,
+            chunk_size=PARALLEL_UPLOAD_CHUNK_SIZE,
+            worker_type=transfer_manager.THREAD,
+            max_workers=PARALLEL_UPLOAD_WORKERS
+        )
+    else:
+        blob.upload_from_filename(file_path)
     gcs_uri = f"gs://{gcs_bucket_name}/{blob_name}"
     print(f"Uploaded '{filename}' to GCS: {gcs_uri}")
     return gcs_uri
 
-def load_gcs_csv_to_bigquery(gcs_uri: str, table_id: str, bq_schema: list[bigquery.SchemaField], filename: str):
+def upload_staged_files(staging_dir: str, staged_names: list[str], gcs_bucket_name: str, gcs_prefix: str = "raw_csv_uploads/") -> dict[str, str]:
     
-    # Loads data from a GCS CSV file into a BigQuery table.
+    # Uploads staged files (paths relative to staging_dir) to GCS and returns {staged_name: gcs_uri} for the ones that made it.
     
-    dataset_ref = bigquery_client.dataset(BIGQUERY_DATASET_ID)
-    table_ref = dataset_ref.table(table_id)
-
-    job_config = bigquery.LoadJobConfig(
+    gcs_uris = {}
+    small_names = []
+    for staged_name in staged_names:
+        staged_path = os.path.join(staging_dir, staged_name)
+        if os.path.getsize(staged_path) > PARALLEL_UPLOAD_THRESHOLD:
+            try:
+                gcs_uris[staged_name] = upload_csv_to_gcs(staged_path, staged_name, gcs_bucket_name, gcs_prefix)
+            except Exception as e:
+                print(f"Failed to upload '{staged_name}' to GCS: {e}")
+        else:
+            small_names.append(staged_name)
+
+    if small_names:
+        # One batch call for all the remaining files. Threads rather than processes: forking after the thread pool and the gRPC
+        # write client have started risks deadlocks, and threads share storage_client and its connection pool.
+        print(f"Uploading {len(small_names)} file(s) to GCS bucket '{gcs_bucket_name}' under '{gcs_prefix}'...")
+        try:
+            upload_results = transfer_manager.upload_many_from_filenames(
+                storage_client.bucket(gcs_bucket_name),
+                small_names,
+                source_directory=staging_dir,
+                blob_name_prefix=gcs_prefix,
+                additional_blob_attributes={'chunk_size': RESUMABLE_UPLOAD_CHUNK_SIZE},
+                max_workers=UPLOAD_CONCURRENCY,
+                worker_type=transfer_manager.THREAD
+            )
+        except Exception as e:
+            upload_results = [e] * len(small_names)
+        for staged_name, upload_result in zip(small_names, upload_results):
+            if isinstance(upload_result, Exception):
+                print(f"Failed to upload '{staged_name}' to GCS: {upload_result}")
+            else:
+                gcs_uris[staged_name] = f"gs://{gcs_bucket_name}/{gcs_prefix}{staged_name}"
+        print(f"Uploaded {len(gcs_uris)}/{len(staged_names)} file(s) to GCS.")
+
+    return gcs_uris
+
+def merge_schemas(schemas: list[list[bigquery.SchemaField]]) -> list[bigquery.SchemaField]:
+    
+    # Merges the schemas inferred from several files of the same table, widening column types where they disagree.
+    
+    # Files served from the schema cache share one list, which is reused as is
+    if all(bq_schema is schemas[0] for bq_schema in schemas):
+        return schemas[0]
+
+    merged = {}
+    for bq_schema in schemas:
+        for field in bq_schema:
+            current = merged.get(field.name)
+            if current is None or TYPE_RANK.get(field.field_type, TYPE_RANK['STRING']) > TYPE_RANK.get(current.field_type, TYPE_RANK['STRING']):
+                merged[field.name] = field
+    return list(merged.values())
+
+# Load job configurations per (table_id, source_format), stored with the schema they were built for
+_JOB_CFG_CACHE: dict[tuple[str, str], tuple[list[bigquery.SchemaField], bigquery.LoadJobConfig]] = {}
+
+def build_load_job_config(bq_schema: list[bigquery.SchemaField], source_format: str = bigquery.SourceFormat.CSV) -> bigquery.LoadJobConfig:
+    
+    # Builds the load job configuration for appending CSV or Parquet data to a table.
+    
+    if source_format == bigquery.SourceFormat.PARQUET:
+        # Parquet carries its own schema
+        return bigquery.LoadJobConfig(
+            source_format=bigquery.SourceFormat.PARQUET,
+            write_disposition=bigquery.WriteDisposition.WRITE_APPEND
+        )
+    return bigquery.LoadJobConfig(
         source_format=bigquery.SourceFormat.CSV,
         skip_leading_rows=1,
         autodetect=False,
@@ -152,28 +555,79 @@ def load_gcs_csv_to_bigquery(gcs_uri: str, table_id: str, bq_schema: list[bigque
         write_disposition=bigquery.WriteDisposition.WRITE_APPEND
     )
 
-    print(f"Loading data from '{gcs_uri}' into BigQuery table '{BIGQUERY_DATASET_ID}.{table_id}'...")
-    load_job = bigquery_client.load_table_from_uri(
-        gcs_uri,
+def get_load_job_config(table_id: str, bq_schema: list[bigquery.SchemaField], source_format: str = bigquery.SourceFormat.CSV) -> bigquery.LoadJobConfig:
+    
+    # Returns the table's load job configuration, building it only for the first file or when the schema changed.
+    # The client copies the configuration into each job, so one instance can be shared.
+    
+    cached = _JOB_CFG_CACHE.get((table_id, source_format))
+    if cached and (cached[0] is bq_schema or cached[0] == bq_schema):
+        return cached[1]
+    job_config = build_load_job_config(bq_schema, source_format)
+    _JOB_CFG_CACHE[(table_id, source_format)] = (bq_schema, job_config)
+    return job_config
+
+def submit_load_job(gcs_uris: list[str], table_id: str, bq_schema: list[bigquery.SchemaField], source_format: str = bigquery.SourceFormat.CSV):
+    
+    # Starts a single BigQuery load job over one or more GCS files and returns it without waiting for completion.
+    
+    dataset_ref = bigquery_client.dataset(BIGQUERY_DATASET_ID)
+    table_ref = dataset_ref.table(table_id)
+
+    print(f"Submitting load job for {len(gcs_uris)} file(s) into BigQuery table '{BIGQUERY_DATASET_ID}.{table_id}'...")
+    return bigquery_client.load_table_from_uri(
+        gcs_uris,
         table_ref,
-        job_config=job_config
+        job_config=get_load_job_config(table_id, bq_schema, source_format)
     )
 
-    try:
-        load_job.result()
-        print(f"Successfully loaded data from '{filename}' into BigQuery table '{BIGQUERY_DATASET_ID}.{table_id}'.")
-        return True
-    except Exception as e:
-        print(f"Failed to load data from '{filename}' into BigQuery table '{BIGQUERY_DATASET_ID}.{table_id}': {load_job.errors or e}")
-        return False
+def submit_direct_load_job(file_path: str, table_id: str, bq_schema: list[bigquery.SchemaField]):
+    
+    # Uploads a local CSV file as part of the load request itself and returns the job without waiting for completion.
+    
+    dataset_ref = bigquery_client.dataset(BIGQUERY_DATASET_ID)
+    table_ref = dataset_ref.table(table_id)
 
-def process_and_upload_csv_data(file_path: str):
+    print(f"Submitting direct load job for '{os.path.basename(file_path)}' into BigQuery table '{BIGQUERY_DATASET_ID}.{table_id}'...")
+    with open(file_path, 'rb') as source_file:
+        return bigquery_client.load_table_from_file(
+            source_file,
+            table_ref,
+            job_config=get_load_job_config(table_id, bq_schema)
+        )
+
+def await_loads(jobs: list[tuple[str, bigquery.LoadJob]]) -> int:
+    
+    # Waits for all submitted load jobs to finish, reporting each outcome, and returns how many succeeded.
+    
+    if not jobs:
+        return 0
+
+    print(f"\nWaiting for {len(jobs)} BigQuery load job(s) to finish...")
+    with ThreadPoolExecutor(max_workers=min(len(jobs), UPLOAD_CONCURRENCY)) as executor:
+        futures = {executor.submit(load_job.result): (source, load_job) for source, load_job in jobs}
+        wait(futures)
+
+    succeeded = 0
+    for future, (source, load_job) in futures.items():
+        destination = f"{load_job.destination.dataset_id}.{load_job.destination.table_id}"
+        if future.exception() is None:
+            print(f"Successfully loaded data from {source} into BigQuery table '{destination}'.")
+            succeeded += 1
+        else:
+            print(f"Failed to load data from {source} into BigQuery table '{destination}': {load_job.errors or future.exception()}")
+    return succeeded
+
+def process_and_upload_csv_data(file_path: str, staging_dir: str, file_stat: os.stat_result | None = None):
     
-    # Parses the filename, uploads CSV to GCS, and loads data into BigQuery.
+    # Parses the filename and sends the CSV towards BigQuery, picking the route by file size.
+    # Returns {'filename', 'load_job'} for a direct load, {'table_id', 'source_format', 'staged_name', 'bq_schema'} for a file staged under staging_dir for the batch GCS upload, or None if the file was skipped or already written.
     
     filename = os.path.basename(file_path)
     base_name, file_extension = os.path.splitext(filename)
 
+    print(f"\n--- Processing file: {filename} ---")
+
     if file_extension.lower() != ".csv":
         print(f"Skipping '{filename}': Not a CSV file.")
         return
@@ -197,22 +651,54 @@ def process_and_upload_csv_data(file_path: str):
 
         ensure_bigquery_dataset_exists(BIGQUERY_DATASET_ID)
 
-        bq_schema = get_table_schema_from_csv(file_path)
+        file_stat = file_stat or os.stat(file_path)
+        file_size = file_stat.st_size
+        use_parquet = pa is not None and file_size >= PARQUET_MIN_BYTES
+        use_storage_write = pa is not None and bigquery_write_client is not None and file_size < STORAGE_WRITE_MAX_BYTES
+
+        # Files bound for the gzip GCS route have their schema inferred from their first block, which the compression then reuses,
+        # so the start of the file is read once. Very large files keep the samples spread over the whole file.
+        first_block = b''
+        infer_schema = get_table_schema_from_csv
+        if not (use_parquet or use_storage_write) and DIRECT_LOAD_MAX_BYTES <= file_size < CHUNK_SAMPLED_INFERENCE_MIN_BYTES:
+            with open(file_path, 'rb') as source:
+                first_block = source.read(COPY_BUFFER_SIZE)
+            infer_schema = lambda path: get_table_schema_from_block(first_block, len(first_block) == file_size)
+
+        bq_schema = get_table_schema(table_id, file_path, file_stat, infer_schema)
         if not bq_schema:
             print(f"Failed to infer BigQuery schema for '{filename}'. Cannot proceed.")
             return
 
-        if not ensure_bigquery_table_exists(table_id, bq_schema):
-            print(f"Could not ensure BigQuery table '{BIGQUERY_DATASET_ID}.{table_id}' exists. Skipping data load for '{filename}'.")
-            return
-
-        gcs_uri = upload_csv_to_gcs(file_path, filename, GCP_BUCKET_NAME)
-        if not gcs_uri:
-            print(f"Failed to upload '{filename}' to GCS. Skipping BigQuery load.")
+        bq_schema = ensure_bigquery_table_exists(table_id, bq_schema)
+        if not bq_schema:
+            print(f"Could not ensure BigQuery table '{BIGQUERY_DATASET_ID}.{table_id}' exists with the file's columns. Skipping data load for '{filename}'.")
             return
 
-        if not load_gcs_csv_to_bigquery(gcs_uri, table_id, bq_schema, filename):
-             print(f"Failed to load data from '{filename}' into BigQuery. Check BigQuery job logs for details.")
+        # Small files skip GCS and load jobs entirely; an uncommitted pending stream leaves nothing behind if it fails
+        if use_storage_write:
+            if write_csv_with_storage_api(file_path, table_id, bq_schema):
+                return
+
+        # With DIRECT_LOAD_MAX_BYTES set, files below it are loaded straight from disk, one job per file, instead of in their table's GCS load
+        if file_size < DIRECT_LOAD_MAX_BYTES:
+            return {'filename': filename, 'load_job': submit_direct_load_job(file_path, table_id, bq_schema)}
+
+        # Large files are staged as Parquet (fewer bytes over the wire and no CSV parsing on the BigQuery side), the rest as gzip CSV.
+        # Staged files sit under a per-table folder, so all files of a table land under one GCS prefix and load in a single job.
+        # Staging runs after get_table_schema has released the table's lock, so other files of the table are not held up by it.
+        os.makedirs(os.path.join(staging_dir, table_id), exist_ok=True)
+        source_format = bigquery.SourceFormat.CSV
+        staged_name = f"{table_id}/{filename}.gz"
+        if use_parquet:
+            parquet_name = f"{table_id}/{base_name}.parquet"
+            if convert_csv_to_parquet(file_path, bq_schema, os.path.join(staging_dir, parquet_name)):
+                source_format = bigquery.SourceFormat.PARQUET
+                staged_name = parquet_name
+        if source_format == bigquery.SourceFormat.CSV:
+            compress_csv_to_gzip(file_path, os.path.join(staging_dir, staged_name), first_block)
+
+        return {'table_id': table_id, 'source_format': source_format, 'staged_name': staged_name, 'bq_schema': bq_schema}
 
     except Exception as e:
         print(f"An unexpected error occurred while processing '{filename}': {e}")
@@ -227,18 +713,50 @@ def process_directory(directory_path: str):
         return
 
     print(f"Processing directory: {directory_path}")
-    processed_files_count = 0
-
-    for filename in os.listdir(directory_path):
-        file_path = os.path.join(directory_path, filename)
-
-        if os.path.isfile(file_path):
-            print(f"\n--- Processing file: {filename} ---")
-            process_and_upload_csv_data(file_path)
-            processed_files_count += 1
+    # scandir entries carry the file type and stat info, sparing a stat() per file here and downstream
+    with os.scandir(directory_path) as entries:
+        file_entries = [entry for entry in entries if entry.is_file()]
+    file_paths = [entry.path for entry in file_entries]
+    file_stats = [entry.stat() for entry in file_entries]
+
+    with tempfile.TemporaryDirectory(prefix="gcp_csv_staging_", dir=STAGING_DIR) as staging_dir:
+        # Inference, direct loads and staging are I/O bound, so files are processed concurrently to overlap network latency
+        with ThreadPoolExecutor(max_workers=UPLOAD_CONCURRENCY) as executor:
+            results = list(executor.map(process_and_upload_csv_data, file_paths, repeat(staging_dir), file_stats))
+        processed_files_count = len(file_paths)
+
+        jobs = []
+        staged_files = []
+        for result in results:
+            if not result:
+                continue
+            if 'load_job' in result:
+                jobs.append((f"'{result['filename']}'", result['load_job']))
+            else:
+                staged_files.append(result)
+        direct_jobs_count = len(jobs)
+
+        gcs_uris = upload_staged_files(staging_dir, [staged['staged_name'] for staged in staged_files], GCP_BUCKET_NAME) if staged_files else {}
+
+    # One load job per table over all of its uploaded files keeps well under the per-table daily load quota
+    uploads_by_table = {}
+    for staged in staged_files:
+        if staged['staged_name'] in gcs_uris:
+            uploads_by_table.setdefault((staged['table_id'], staged['source_format']), []).append((gcs_uris[staged['staged_name']], staged['bq_schema']))
+
+    for (table_id, source_format), uploads in uploads_by_table.items():
+        table_gcs_uris = [gcs_uri for gcs_uri, _ in uploads]
+        bq_schema = merge_schemas([bq_schema for _, bq_schema in uploads])
+        try:
+            jobs.append((f"{len(table_gcs_uris)} {source_format} file(s)", submit_load_job(table_gcs_uris, table_id, bq_schema, source_format)))
+        except Exception as e:
+            print(f"Failed to submit load job for BigQuery table '{BIGQUERY_DATASET_ID}.{table_id}': {e}")
+
+    loaded_jobs_count = await_loads(jobs)
 
     print("\n--- Processing Summary ---")
     print(f"Total files attempted to process: {processed_files_count}")
+    print(f"BigQuery load jobs succeeded: {loaded_jobs_count}/{direct_jobs_count + len(uploads_by_table)}")
     print("Please check the logs above for specific success/failure messages for each file.")
 
 